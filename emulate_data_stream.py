@@ -1,20 +1,49 @@
-import timeit
-from dataclasses import dataclass, asdict
+import struct
 from threading import Event
-from time import sleep
+from time import perf_counter, sleep
 
-import numba as nb
+import msgspec
 import numpy as np
 import zmq
 
+try:
+    # Optional, generates the frames on the GPU when a CUDA device is available
+    import cupy as cp
+except ImportError:
+    cp = None
+
 
 MIN_STEPS = 10
 MAX_STEPS = 20
 MIN_DWELL_TIME = 1e-3
-
-
-@dataclass
-class ScanMD:
+# Smoothing of the measured frame generation time, used to keep the frame rate at the exposure time
+GEN_TIME_EMA_WEIGHT = 0.1
+# Shorter sleeps are skipped, they cost a syscall but do not change the frame rate
+MIN_SLEEP_S = 1e-5
+# Progress is printed once per this many frames instead of for every frame
+PRINT_EVERY_N_FRAMES = 100
+
+# Two ZMQ I/O threads: the bulk data socket gets its own, metadata uses the other
+IO_THREADS = 2
+DATA_IO_AFFINITY = 0b01
+MD_IO_AFFINITY = 0b10
+
+# Bulk data socket tuning: bounded queue of raw frames and larger OS socket buffers
+DATA_HWM = 64
+DATA_SOCKET_BUFFER_BYTES = 8 * 1024 * 1024
+
+# Fixed-length binary frame header: dtype code, ndim, frame count, dim0, dim1.
+# Must match FRAME_HEADER / FRAME_DTYPES in src/reducer.py
+FRAME_HEADER = struct.Struct("<BBHII")
+FRAME_DTYPE_CODES = {np.dtype(np.float32): 0, np.dtype(np.float64): 1}
+
+# Frames sent together as one multipart message (header + frames).
+# Frames are only held back for at most one GUI refresh, so slow scans still send every frame right away.
+MAX_FRAMES_PER_MESSAGE = 8
+BATCH_WINDOW_S = 0.033
+
+
+class ScanMD(msgspec.Struct):
     x_start: float
     x_stop: float
     x_num: int
@@ -25,16 +54,6 @@ class ScanMD:
     detector_shape: tuple[int, int]
 
 
-@nb.njit("float32[:,:](int_, int_)", parallel=True)
-def nb_rand(n, m):
-    res = np.empty((n, m), dtype=np.float32)
-    # Parallel loop
-    for i in nb.prange(n):
-        for j in range(m):
-            res[i, j] = np.random.rand()
-    return res
-
-
 class PublisherEmulator:
     def __init__(
         self,
@@ -44,6 +63,7 @@ class PublisherEmulator:
         data_host: str = "127.0.0.1",
         data_port: int = 50002,
         sleep_between_scans_s: int = 5,
+        use_gpu: bool = True,
     ):
         self.detector_shape = detector_shape
         self.md_host = md_host
@@ -52,10 +72,26 @@ class PublisherEmulator:
         self.data_port = data_port
 
         self.sleep_between_scans_s = sleep_between_scans_s
+        self._header_buf = bytearray(FRAME_HEADER.size)
+        self._md_encoder = msgspec.json.Encoder()
+        self._gen_time_ema_s = 0.0
+        # Frame buffers reused for every generated frame, one per frame of a batched message.
+        # Allocated per scan for the frames it batches, see _resize_frame_bufs.
+        # They are sent with copy=False, overwriting a frame still queued in ZMQ only changes random content.
+        self._frame_bufs = []
+        self._rng = np.random.default_rng()  # PCG64, fills the whole buffer in one vectorized call
+        self._gpu_buf = None
+        if use_gpu:
+            self._setup_gpu()
 
         self.stopped = Event()
-        self.md_pub_sock = zmq.Context.instance().socket(zmq.PUB)
-        self.data_pub_sock = zmq.Context.instance().socket(zmq.PUB)
+        self.context = zmq.Context(io_threads=IO_THREADS)
+        self.md_pub_sock = self.context.socket(zmq.PUB)
+        self.md_pub_sock.setsockopt(zmq.AFFINITY, MD_IO_AFFINITY)
+        self.data_pub_sock = self.context.socket(zmq.PUB)
+        self.data_pub_sock.setsockopt(zmq.AFFINITY, DATA_IO_AFFINITY)
+        self.data_pub_sock.setsockopt(zmq.SNDHWM, DATA_HWM)
+        self.data_pub_sock.setsockopt(zmq.SNDBUF, DATA_SOCKET_BUFFER_BYTES)
         self.connect()
 
     def connect(self) -> None:
@@ -67,6 +103,32 @@ class PublisherEmulator:
         sleep(1.0)
         # --- END OF FIX ---
 
+    def _setup_gpu(self) -> None:
+        if cp is None:
+            return
+        try:
+            if cp.cuda.runtime.getDeviceCount() == 0:
+                return
+            self._gpu_rng = cp.random.default_rng()
+            self._gpu_buf = cp.empty(self.detector_shape, dtype=cp.float32)
+            print("[Emulator] Generating frames on the GPU.")
+        except cp.cuda.runtime.CUDARuntimeError:
+            self._gpu_buf = None
+
+    def _resize_frame_bufs(self, count: int) -> None:
+        # Only as many full-detector buffers as the scan batches into one message.
+        # ZMQ keeps its own reference to a buffer still being sent, dropping it here is safe.
+        del self._frame_bufs[count:]
+        while len(self._frame_bufs) < count:
+            if self._gpu_buf is not None:
+                # Pinned host memory for a fast device-to-host copy
+                frame_buf = np.frombuffer(
+                    cp.cuda.alloc_pinned_memory(self._gpu_buf.nbytes), dtype=np.float32, count=self._gpu_buf.size
+                ).reshape(self.detector_shape)
+            else:
+                frame_buf = np.empty(self.detector_shape, dtype=np.float32)
+            self._frame_bufs.append(frame_buf)
+
     def run(self) -> None:
         self._publish()
 
@@ -74,15 +136,21 @@ class PublisherEmulator:
         random_frame = np.random.rand(*self.detector_shape)
         return random_frame
 
-    def _generate_data_fast(self) -> np.ndarray:
-        # Generate random data faster with numba and float32
-        random_frame = nb_rand(*self.detector_shape)
-        return random_frame
+    def _generate_data_fast(self, slot: int = 0) -> np.ndarray:
+        frame_buf = self._frame_bufs[slot]
+        if self._gpu_buf is not None:
+            # Generate on the GPU and copy into the pinned frame buffer
+            self._gpu_rng.random(dtype=cp.float32, out=self._gpu_buf)
+            self._gpu_buf.get(out=frame_buf)
+            return frame_buf
+        # Generate random data faster with a PCG64 generator and float32, into the reused frame buffer
+        self._rng.random(out=frame_buf, dtype=np.float32)
+        return frame_buf
 
     def _generate_md(self) -> ScanMD:
         x_start, x_stop, x_num = self._generate_axis_md()
         y_start, y_stop, y_num = self._generate_axis_md()
-        exposure_time_s = max(MIN_DWELL_TIME, np.random.rand())
+        exposure_time_s = max(MIN_DWELL_TIME, self._rng.random())
         return ScanMD(
             x_start=x_start,
             x_stop=x_stop,
@@ -94,47 +162,56 @@ class PublisherEmulator:
             detector_shape=self.detector_shape,
         )
 
-    @staticmethod
-    def _generate_axis_md() -> tuple[float, float, int]:
-        start = np.random.rand()
-        step = np.random.rand()
-        num = np.random.randint(low=MIN_STEPS, high=MAX_STEPS)
-        invert_mult = np.random.choice(
-            [-1, 1]
-        )  # axis can be scanned in either direction
+    def _generate_axis_md(self) -> tuple[float, float, int]:
+        start = self._rng.random()
+        step = self._rng.random()
+        # Plain Python int, msgspec does not encode numpy scalars
+        num = int(self._rng.integers(low=MIN_STEPS, high=MAX_STEPS))
+        invert_mult = 1 if self._rng.random() < 0.5 else -1  # axis can be scanned in either direction
         stop = start + step * invert_mult * num
         return start, stop, num
 
-    def _send_data(self, data_array: np.ndarray):
-        md = dict(
-            dtype=str(data_array.dtype),
-            shape=data_array.shape,
+    def _send_data(self, data_arrays: list[np.ndarray]):
+        # One multipart message: the header followed by frames of identical dtype and shape
+        first = data_arrays[0]
+        FRAME_HEADER.pack_into(
+            self._header_buf, 0, FRAME_DTYPE_CODES[first.dtype], 2, len(data_arrays), *first.shape
         )
-        self.data_pub_sock.send_json(md, zmq.SNDMORE)
-        self.data_pub_sock.send(data_array, copy=False)
+        self.data_pub_sock.send(self._header_buf, zmq.SNDMORE)
+        for data_array in data_arrays[:-1]:
+            self.data_pub_sock.send(data_array, zmq.SNDMORE, copy=False)
+        self.data_pub_sock.send(data_arrays[-1], copy=False)
 
     def _publish(self):
         while not self.stopped.is_set():
             scan_md = self._generate_md()
             print(scan_md)
-            self.md_pub_sock.send_json(asdict(scan_md))
-            ns = globals()
-            ns["self"] = self
-            gen_time_s = timeit.timeit(
-                f"self._generate_data_fast()", globals=ns, number=10
+            self.md_pub_sock.send(self._md_encoder.encode(scan_md))
+            frames_per_message = max(
+                1, min(MAX_FRAMES_PER_MESSAGE, int(BATCH_WINDOW_S / max(scan_md.exposure_time_s, 1e-9)))
             )
-            sleep_between_frames_s = max(0.0, scan_md.exposure_time_s - gen_time_s / 10)
-            for i in range(scan_md.x_num * scan_md.y_num):
+            self._resize_frame_bufs(frames_per_message)
+            num_frames = scan_md.x_num * scan_md.y_num
+            batch = []
+            for i in range(num_frames):
                 if self.stopped.is_set():
                     return
-                print(f"Send frame {i}")
-                frame_data = self._generate_data_fast()
-                self._send_data(data_array=frame_data)
-                sleep(sleep_between_frames_s)
+                if i % PRINT_EVERY_N_FRAMES == 0:
+                    print(f"Send frame {i}/{num_frames}")
+                # Time the real frame generation instead of generating throw-away frames up front
+                t0 = perf_counter()
+                batch.append(self._generate_data_fast(slot=len(batch)))
+                self._gen_time_ema_s += GEN_TIME_EMA_WEIGHT * (perf_counter() - t0 - self._gen_time_ema_s)
+                if len(batch) == frames_per_message or i == num_frames - 1:
+                    self._send_data(data_arrays=batch)
+                    batch = []
+                sleep_between_frames_s = scan_md.exposure_time_s - self._gen_time_ema_s
+                if sleep_between_frames_s > MIN_SLEEP_S:
+                    sleep(sleep_between_frames_s)
 
             if self.stopped.is_set():
                 return
-            sleep(self.sleep_between_scans_s - gen_time_s)
+            sleep(self.sleep_between_scans_s)
 
     def close(self):
         self.stopped.set()
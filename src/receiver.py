@@ -1,24 +1,42 @@
+import sys
+
 import zmq
 
 SIM_DATA_HOST = "127.0.0.1"
 SIM_DATA_PORT = 50002
 
 # This is an internal queue.
-REDUCER_QUEUE_ADDR = "tcp://127.0.0.1:5555"
+# IPC (UNIX domain socket) skips the TCP loopback stack, Windows falls back to TCP.
+if sys.platform == "win32":
+    REDUCER_QUEUE_ADDR = "tcp://127.0.0.1:5555"
+else:
+    REDUCER_QUEUE_ADDR = "ipc:///tmp/livestxm-reducer"
+
+# Bulk data socket tuning: bounded queue of raw frames and larger OS socket buffers
+DATA_HWM = 64
+DATA_SOCKET_BUFFER_BYTES = 8 * 1024 * 1024
+
+# Two ZMQ I/O threads: one reads from the simulator, the other writes to the Reducer
+IO_THREADS = 2
+SIM_IO_AFFINITY = 0b01
+REDUCER_IO_AFFINITY = 0b10
 
 def main():
     """
     Connects to the simulator's DATA stream and forwards
     every received frame to the Reducer process via an
-    internal PUSH/PULL queue.
+    internal PUSH/PULL queue, using a zmq.proxy.
     """
     print(f"[Receiver] Starting...")
 
-    context = zmq.Context()
+    context = zmq.Context(io_threads=IO_THREADS)
 
     # --- Input Socket (from Simulator) ---
     # SUB socket connects to the simulator's PUB.
     sim_socket = context.socket(zmq.SUB)
+    sim_socket.setsockopt(zmq.AFFINITY, SIM_IO_AFFINITY)
+    sim_socket.setsockopt(zmq.RCVHWM, DATA_HWM)
+    sim_socket.setsockopt(zmq.RCVBUF, DATA_SOCKET_BUFFER_BYTES)
     sim_socket.connect(f"tcp://{SIM_DATA_HOST}:{SIM_DATA_PORT}")
     sim_socket.subscribe(b"")
     print(f"[Receiver] Subscribed to DATA at tcp://{SIM_DATA_HOST}:{SIM_DATA_PORT}")
@@ -27,20 +45,16 @@ def main():
     # A PUSH socket. PUSH/PULL is a load-balancing queue. The Receiver can 'PUSH' data as fast as it arrives, and the
     # Reducer can 'PULL' it as fast as it can process it.
     reducer_socket = context.socket(zmq.PUSH)
+    reducer_socket.setsockopt(zmq.AFFINITY, REDUCER_IO_AFFINITY)
+    reducer_socket.setsockopt(zmq.SNDHWM, DATA_HWM)
     reducer_socket.bind(REDUCER_QUEUE_ADDR)
     print(f"[Receiver] PUSHing data to {REDUCER_QUEUE_ADDR}")
 
     print("[Receiver] Running.")
     try:
-        while True:
-            # Receive the two-part message from the simulator
-            header = sim_socket.recv_json()
-            buffer = sim_socket.recv(copy=False)
-
-            # Forward both parts to the Reducer.
-            # SNDMORE to send it as a multi-part message so the Reducer gets them together.
-            reducer_socket.send_json(header, zmq.SNDMORE)
-            reducer_socket.send(buffer, copy=False)
+        # Forward every multipart message (binary header + one or more frame buffers) from the simulator to the Reducer.
+        # zmq.proxy runs entirely inside libzmq, so frames are never touched by Python on this hop.
+        zmq.proxy(sim_socket, reducer_socket)
 
     except KeyboardInterrupt:
         print("\n[Receiver] Shutting down.")
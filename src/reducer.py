@@ -1,20 +1,128 @@
+import json
+import queue
+import struct
+import sys
+import threading
+
+import msgspec
 import zmq
+import numba as nb
 import numpy as np
 
-# Input from Receiver
-RECEIVER_QUEUE_ADDR = "tcp://127.0.0.1:5555"
-
 # Input from Simulator
 SIM_MD_HOST = "127.0.0.1"
 SIM_MD_PORT = 50001
 
-# Outputs to GUI
-GUI_STXM_ADDR = "tcp://127.0.0.1:5556"  #
-GUI_FRAME_ADDR = "tcp://127.0.0.1:5557" # Publish Frames
-GUI_MD_ADDR = "tcp://127.0.0.1:5558"  # Forwarding metadata
+# Same-host sockets use IPC (UNIX domain sockets) to skip the TCP loopback stack, Windows falls back to TCP.
+if sys.platform == "win32":
+    # Input from Receiver
+    RECEIVER_QUEUE_ADDR = "tcp://127.0.0.1:5555"
+
+    # Outputs to GUI
+    GUI_STXM_ADDR = "tcp://127.0.0.1:5556"  # Publish STXM points
+    GUI_FRAME_ADDR = "tcp://127.0.0.1:5557" # Publish Frames
+    GUI_MD_ADDR = "tcp://127.0.0.1:5558"  # Forwarding metadata
+else:
+    # Input from Receiver
+    RECEIVER_QUEUE_ADDR = "ipc:///tmp/livestxm-reducer"
+
+    # Outputs to GUI
+    GUI_STXM_ADDR = "ipc:///tmp/livestxm-stxm"  # Publish STXM points
+    GUI_FRAME_ADDR = "ipc:///tmp/livestxm-frame" # Publish Frames
+    GUI_MD_ADDR = "ipc:///tmp/livestxm-metadata"  # Forwarding metadata
 
 DOWNSAMPLE_FACTOR = 10
 
+# Bounded queue of raw frames from the Receiver
+RECEIVER_HWM = 64
+# The GUI only displays the newest frame, there is no use in queueing more
+FRAME_HWM = 1
+# Frames are only displayed, half precision is enough and halves the bytes sent to the GUI
+FRAME_WIRE_DTYPE = np.float16
+
+# Two ZMQ I/O threads: one for the raw frames coming in, the other for everything else
+IO_THREADS = 2
+INPUT_IO_AFFINITY = 0b01
+OUTPUT_IO_AFFINITY = 0b10
+
+# Received messages waiting to be reduced. Small, so back-pressure reaches the Receiver's ZMQ queue.
+INPUT_QUEUE_SIZE = 2
+
+# Fixed-length binary frame header: dtype code, ndim, frame count, dim0, dim1.
+# Must match FRAME_HEADER / FRAME_DTYPE_CODES in emulate_data_stream.py
+FRAME_HEADER = struct.Struct("<BBHII")
+FRAME_DTYPES = {0: np.float32, 1: np.float64}
+
+# Binary STXM points (frame index, summed intensity), one or more per message.
+# Must match STXM_POINT_DTYPE in visualizer.py
+STXM_POINT_DTYPE = np.dtype([('index', '<u4'), ('intensity', '<f4')])
+
+
+# C-contiguous signatures ([:,::1]) let the prange loop index rows directly.
+# error_model="numpy" drops the zero-division checks on the % and // in the loop.
+@nb.njit(
+    [
+        "float64(float32[:,::1], float32[:,::1], int64)",
+        "float64(float64[:,::1], float64[:,::1], int64)",
+    ],
+    parallel=True,
+    fastmath=True,
+    nogil=True,
+    boundscheck=False,
+    error_model="numpy",
+)
+def reduce_frame(frame, out, factor):
+    """
+    Sums the frame and writes its downsampled copy (frame[::factor, ::factor]) into 'out' in a single pass.
+    Returns the summed intensity.
+    """
+    total = 0.0
+    # Parallel loop over rows, each row accumulates its own partial sum
+    for i in nb.prange(frame.shape[0]):
+        row = frame[i]
+        local = 0.0
+        for j in range(frame.shape[1]):
+            local += row[j]
+        if i % factor == 0:
+            # Gather every factor-th pixel of the row into the contiguous output row
+            out_row = out[i // factor]
+            for k in range(out.shape[1]):
+                out_row[k] = row[k * factor]
+        total += local
+    return total
+
+
+def downsampled_shape(shape):
+    """Shape of frame[::DOWNSAMPLE_FACTOR, ::DOWNSAMPLE_FACTOR] for a frame of the given shape."""
+    return tuple(-(-n // DOWNSAMPLE_FACTOR) for n in shape)
+
+
+def receive_inputs(receiver_socket, md_socket, input_queue, stop_event):
+    """
+    Input thread of the Reducer.
+    Receives metadata and frame messages and puts them, in arrival order, into 'input_queue', so the next message
+    is received while the main thread is still reducing the previous one.
+    An error is put into the queue as well, the main thread re-raises it.
+    """
+    try:
+        poller = zmq.Poller()
+        poller.register(receiver_socket, zmq.POLLIN)
+        poller.register(md_socket, zmq.POLLIN)
+
+        while not stop_event.is_set():
+            # Poll with a timeout (100ms). Allows the loop to check stop_event
+            socks = dict(poller.poll(100))
+
+            if md_socket in socks:
+                input_queue.put(("metadata", md_socket.recv()))
+
+            if receiver_socket in socks:
+                # One message holds the header followed by one or more frames of the same dtype and shape
+                input_queue.put(("frames", receiver_socket.recv_multipart(copy=False, track=False)))
+    except Exception as e:
+        # Hand the error to the main thread, it would otherwise wait on the queue forever
+        input_queue.put(("error", e))
+
 
 def main():
     """
@@ -25,91 +133,147 @@ def main():
     """
     print(f"[Reducer] Starting...")
 
-    context = zmq.Context()
+    context = zmq.Context(io_threads=IO_THREADS)
 
     # --- Input Socket (from Receiver) ---
     receiver_socket = context.socket(zmq.PULL)
+    receiver_socket.setsockopt(zmq.AFFINITY, INPUT_IO_AFFINITY)
+    receiver_socket.setsockopt(zmq.RCVHWM, RECEIVER_HWM)
     receiver_socket.connect(RECEIVER_QUEUE_ADDR)
     print(f"[Reducer] PULLing data from {RECEIVER_QUEUE_ADDR}")
 
     # --- Input Socket (from Simulator Metadata) ---
     md_socket = context.socket(zmq.SUB)
+    md_socket.setsockopt(zmq.AFFINITY, OUTPUT_IO_AFFINITY)
     md_socket.connect(f"tcp://{SIM_MD_HOST}:{SIM_MD_PORT}")
     md_socket.subscribe(b"")
     print(f"[Reducer] Subscribed to METADATA at tcp://{SIM_MD_HOST}:{SIM_MD_PORT}")
 
     # --- Output Sockets (to GUI) ---
     stxm_pub_socket = context.socket(zmq.PUB)
+    stxm_pub_socket.setsockopt(zmq.AFFINITY, OUTPUT_IO_AFFINITY)
     stxm_pub_socket.bind(GUI_STXM_ADDR)
     print(f"[Reducer] Publishing STXM data to {GUI_STXM_ADDR}")
 
     frame_pub_socket = context.socket(zmq.PUB)
+    frame_pub_socket.setsockopt(zmq.AFFINITY, OUTPUT_IO_AFFINITY)
+    # A HWM of 1 keeps at most one frame queued, newer frames are dropped while it waits (not the queued one).
+    # ZMQ_CONFLATE would keep the newest instead, but does not support multipart messages.
+    frame_pub_socket.setsockopt(zmq.SNDHWM, FRAME_HWM)
     frame_pub_socket.bind(GUI_FRAME_ADDR)
     print(f"[Reducer] Publishing FRAME data to {GUI_FRAME_ADDR}")
 
     # --- Metadata Output Socket (to GUI) ---
     md_pub_socket = context.socket(zmq.PUB)
+    md_pub_socket.setsockopt(zmq.AFFINITY, OUTPUT_IO_AFFINITY)
     md_pub_socket.bind(GUI_MD_ADDR)
     print(f"[Reducer] Publishing METADATA to {GUI_MD_ADDR}")
 
-    # --- Poller for Multiple Inputs ---
-    poller = zmq.Poller()
-    poller.register(receiver_socket, zmq.POLLIN)
-    poller.register(md_socket, zmq.POLLIN)
+    # --- Input Thread ---
+    # Pipelines receiving with reducing, the GIL is released inside ZMQ and the numba kernel.
+    input_queue = queue.Queue(maxsize=INPUT_QUEUE_SIZE)
+    stop_event = threading.Event()
+    input_thread = threading.Thread(
+        target=receive_inputs,
+        args=(receiver_socket, md_socket, input_queue, stop_event),
+        daemon=True,
+    )
 
+    md_decoder = msgspec.json.Decoder()
     frame_index = 0
+    # Downsampled output buffer and its half precision copy sent to the GUI,
+    # reused while the detector shape stays the same
+    downsampled_frame = None
+    wire_frame = None
+    frame_header = None
+    frame_tracker = None
+    input_thread.start()
     print("[Reducer] Running.")
 
     try:
         while True:
-            socks = dict(poller.poll())
+            kind, payload = input_queue.get()
 
             # --- Case 1: New Metadata Arrives ---
-            if md_socket in socks:
-                md = md_socket.recv_json()
+            if kind == "metadata":
+                md_bytes = payload
+                md = md_decoder.decode(md_bytes)
                 print("[Reducer] === New Scan DETECTED === Resetting index to 0")
                 frame_index = 0
 
+                # Pre-allocate the downsampled output for the new detector shape.
+                # Without it in the metadata, the frame loop allocates on the first frame instead.
+                detector_shape = md.get('detector_shape')
+                if detector_shape is not None:
+                    downsampled_frame = np.empty(downsampled_shape(detector_shape), dtype=np.float32)
+                    # The half precision copy must follow, the frame loop only re-checks the downsampled buffer's shape
+                    wire_frame = None
+                    frame_header = None
+
                 # --- NEW: Forward metadata to GUI ---
-                # Publish the received metadata on the new topic.
+                # Publish the received metadata on the new topic, the JSON bytes are forwarded as-is.
                 md_pub_socket.send_string("metadata", zmq.SNDMORE)
-                md_pub_socket.send_json(md)
+                md_pub_socket.send(md_bytes)
 
             # --- Case 2: New Frame Data Arrives ---
-            if receiver_socket in socks:
-                header = receiver_socket.recv_json()
-                buffer = receiver_socket.recv(copy=False)
+            elif kind == "frames":
+                parts = payload
+                dtype_code, _, _, height, width = FRAME_HEADER.unpack_from(parts[0].buffer)
+                # One STXM point per frame, all sent together after the message is reduced
+                stxm_points = np.empty(len(parts) - 1, dtype=STXM_POINT_DTYPE)
 
-                frame = np.frombuffer(
-                    buffer,
-                    dtype=header['dtype']
-                ).reshape(header['shape'])
+                for point, buffer in enumerate(parts[1:]):
+                    # Wrap the ZMQ frame's memoryview directly, no copy of the raw frame is made
+                    frame = np.frombuffer(
+                        buffer.buffer,
+                        dtype=FRAME_DTYPES[dtype_code]
+                    ).reshape(height, width)
 
-                intensity = np.sum(frame)
-                downsampled_frame = frame[::DOWNSAMPLE_FACTOR, ::DOWNSAMPLE_FACTOR].copy()
+                    # Re-allocate if the frame does not fit the buffer
+                    if (downsampled_frame is None
+                            or downsampled_frame.shape != downsampled_shape(frame.shape)
+                            or downsampled_frame.dtype != frame.dtype):
+                        downsampled_frame = np.empty(downsampled_shape(frame.shape), dtype=frame.dtype)
+                        wire_frame = None
+                        frame_header = None
+
+                    # Sum and downsample in one pass over the frame
+                    intensity = reduce_frame(frame, downsampled_frame, DOWNSAMPLE_FACTOR)
+
+                    stxm_points[point] = (frame_index, intensity)
+                    frame_index += 1
+
+                # Send Frame data, only the last (newest) frame of the message.
+                # The GUI only displays the newest frame, older frames of the batch would only be dropped.
+                # Re-allocate the sent buffer if ZMQ still holds the previous frame
+                if wire_frame is None or (frame_tracker is not None and not frame_tracker.done):
+                    wire_frame = np.empty(downsampled_frame.shape, dtype=FRAME_WIRE_DTYPE)
+                # The frame header only changes with the shape, encode it once per shape
+                if frame_header is None:
+                    frame_header = json.dumps({
+                        'dtype': str(wire_frame.dtype),
+                        'shape': wire_frame.shape
+                    }).encode()
+                np.copyto(wire_frame, downsampled_frame, casting='same_kind')
+                # Never waits on the GUI, a PUB socket drops the frame when the GUI's queue is full
+                frame_tracker = frame_pub_socket.send_multipart(
+                    [b"frame_data", frame_header, wire_frame],
+                    copy=False,
+                    track=True,
+                )
 
                 # Send STXM data
-                stxm_data = {
-                    'index': frame_index,
-                    'intensity': float(intensity)
-                }
-                stxm_pub_socket.send_string("stxm_data", zmq.SNDMORE)
-                stxm_pub_socket.send_json(stxm_data)
-
-                # Send Frame data
-                frame_header = {
-                    'dtype': str(downsampled_frame.dtype),
-                    'shape': downsampled_frame.shape
-                }
-                frame_pub_socket.send_string("frame_data", zmq.SNDMORE)
-                frame_pub_socket.send_json(frame_header, zmq.SNDMORE)
-                frame_pub_socket.send(downsampled_frame, copy=False)
-
-                frame_index += 1
+                stxm_pub_socket.send_multipart([b"stxm_data", stxm_points], copy=False)
+
+            # --- Case 3: The Input Thread Failed ---
+            elif kind == "error":
+                raise RuntimeError("[Reducer] Input thread stopped with an error") from payload
 
     except KeyboardInterrupt:
         print("\n[Reducer] Shutting down.")
     finally:
+        stop_event.set()
+        input_thread.join(timeout=1.0)
         receiver_socket.close()
         md_socket.close()
         stxm_pub_socket.close()
@@ -1,22 +1,109 @@
 import sys
 import queue
+import selectors
 import threading
 import os
 import json
 import datetime
+import functools
 import time
 
+import msgspec
 import zmq
 import numpy as np
 import pyqtgraph as pg
-import pyqtgraph.exporters as exporters
 from PyQt6 import QtWidgets, QtCore, QtGui
 
 # --- Configuration ---
-# Must match the PUB ports in reducer.py
-REDUCER_STXM_ADDR = "tcp://127.0.0.1:5556"
-REDUCER_FRAME_ADDR = "tcp://127.0.0.1:5557"
-REDUCER_MD_ADDR = "tcp://127.0.0.1:5558"
+# Must match the PUB addresses in reducer.py
+if sys.platform == "win32":
+    REDUCER_STXM_ADDR = "tcp://127.0.0.1:5556"
+    REDUCER_FRAME_ADDR = "tcp://127.0.0.1:5557"
+    REDUCER_MD_ADDR = "tcp://127.0.0.1:5558"
+else:
+    REDUCER_STXM_ADDR = "ipc:///tmp/livestxm-stxm"
+    REDUCER_FRAME_ADDR = "ipc:///tmp/livestxm-frame"
+    REDUCER_MD_ADDR = "ipc:///tmp/livestxm-metadata"
+
+# Binary STXM points (frame index, summed intensity).
+# Must match STXM_POINT_DTYPE in reducer.py
+STXM_POINT_DTYPE = np.dtype([('index', '<u4'), ('intensity', '<f4')])
+
+# Only the newest frame is displayed, keep the frame socket queue short
+FRAME_HWM = 1
+# Reused display frames: one waiting for the GUI, one on display and one being written
+FRAME_RING_SIZE = 3
+
+# Watchdog check interval, slower while in standby
+WATCHDOG_INTERVAL_MS = 3000
+STANDBY_WATCHDOG_INTERVAL_MS = 15000
+
+# The STXM display levels stop following new pixels once this fraction of the scan is placed
+LEVELS_FREEZE_FRACTION = 0.1
+
+# Oldest metadata log lines beyond this are removed, keeps the log bounded over long sessions
+MAX_LOG_LINES = 2000
+
+# Qt maps the PNG quality 0-100 to zlib levels 9-0, 80 is the fast level 1
+PNG_SAVE_QUALITY = 80
+
+
+def format_metadata_log(md):
+    """
+    Formats scan metadata as an entry of the metadata log.
+    Pure Python, called by the receiver thread so the GUI thread only inserts the finished text.
+    """
+    try:
+        now = datetime.datetime.now()
+        time_string = now.strftime("%H:%M:%S")
+        header = f"--- Scan at {time_string} ---"
+        md_string = (
+            f"Scan Dimensions:\n"
+            f"  X: {md['x_num']} steps (from {md['x_start']:.3f} to {md['x_stop']:.3f})\n"
+            f"  Y: {md['y_num']} steps (from {md['y_start']:.3f} to {md['y_stop']:.3f})\n"
+            f"\n"
+            f"Detector:\n"
+            f"  Shape: {md['detector_shape'][0]} x {md['detector_shape'][1]}\n"
+            f"  Exposure: {md['exposure_time_s']:.4f} s\n"
+        )
+        return header + "\n" + md_string
+    except KeyError as e:
+        return f"Error: Missing key in metadata '{e}'\n"
+    except Exception as e:
+        return f"Error parsing metadata:\n{e}\n"
+
+
+def write_scan_files(filepath_base, data, metadata, qimage, transform, size, background):
+    """
+    Writes a saved scan: the raw data (.npy), the metadata (.json) and a quick-look PNG of the map.
+    Runs on a worker thread, all arguments are snapshots taken on the GUI thread.
+    'qimage' is None if the map could not be rendered, the PNG is skipped then.
+    """
+    try:
+        # Save the raw data as a NumPy file
+        np.save(f"{filepath_base}_data.npy", data)
+
+        # Save the metadata as a JSON file
+        with open(f"{filepath_base}_meta.json", 'w') as f:
+            json.dump(metadata, f, indent=4)
+
+        # Save a quick-look PNG of the view.
+        # QImage/QPainter can be used off the GUI thread, unlike pyqtgraph's exporters.
+        if qimage is None or size.isEmpty():
+            print("[Visualizer] Nothing to draw, saved without the PNG.")
+            return
+        png = QtGui.QImage(size, QtGui.QImage.Format.Format_ARGB32)
+        png.fill(background)
+        painter = QtGui.QPainter(png)
+        painter.setTransform(transform)
+        painter.drawImage(QtCore.QRectF(0, 0, qimage.width(), qimage.height()), qimage)
+        painter.end()
+        if not png.save(f"{filepath_base}_image.png", "PNG", PNG_SAVE_QUALITY):
+            raise OSError("could not write the PNG")
+
+        print(f"[Visualizer] Save complete.")
+    except Exception as e:
+        print(f"[Visualizer] ERROR saving scan: {e}")
 
 
 class DataReceiver(threading.Thread):
@@ -24,25 +111,37 @@ class DataReceiver(threading.Thread):
     A dedicated thread for receiving ZMQ data.
     To move all blocking I/O (network) operations off of the main GUI thread.
     This prevents the application from freezing.
-    It connects to the Reducer's PUB sockets and puts received data into thread-safe queues.
+    It connects to the Reducer's PUB sockets and puts received data into a thread-safe queue (STXM points)
+    and single slots that only hold the latest metadata and frame.
     """
 
-    def __init__(self, md_queue, stxm_queue, frame_queue, stop_event):
+    def __init__(self, stxm_queue, stop_event):
         super().__init__()
         self.daemon = True  # Allows app to exit even if thread is running
-        self.md_queue = md_queue
         self.stxm_queue = stxm_queue
-        self.frame_queue = frame_queue
         self.stop_event = stop_event
 
+        # Latest metadata and frame not yet taken by the GUI, a newer one simply replaces them
+        self.slot_lock = threading.Lock()
+        self.latest_md = None
+        self.latest_frame = None
+        self.shown_frame = None  # Last frame taken by the GUI, still referenced by the frame view
+
+        # Preallocated display frames, reallocated when the frame shape changes
+        self.frame_ring = []
+
         # ZMQ setup
         self.context = zmq.Context()
         self.md_socket = self.context.socket(zmq.SUB)
         self.stxm_socket = self.context.socket(zmq.SUB)
         self.frame_socket = self.context.socket(zmq.SUB)
+        self.frame_socket.setsockopt(zmq.RCVHWM, FRAME_HWM)
+
+        # Selector on the sockets' file descriptors
+        self.selector = selectors.DefaultSelector()
 
-        # Poller
-        self.poller = zmq.Poller()
+        # Decodes the metadata and frame headers, faster than the json module
+        self.json_decoder = msgspec.json.Decoder()
 
     def run(self):
         """Main thread loop."""
@@ -58,60 +157,102 @@ class DataReceiver(threading.Thread):
             self.stxm_socket.subscribe("stxm_data")
             self.frame_socket.subscribe("frame_data")
 
-            # Register sockets with poller
-            self.poller.register(self.md_socket, zmq.POLLIN)
-            self.poller.register(self.stxm_socket, zmq.POLLIN)
-            self.poller.register(self.frame_socket, zmq.POLLIN)
+            # Register the sockets' file descriptors with the selector
+            self.selector.register(self.md_socket.get(zmq.FD), selectors.EVENT_READ)
+            self.selector.register(self.stxm_socket.get(zmq.FD), selectors.EVENT_READ)
+            self.selector.register(self.frame_socket.get(zmq.FD), selectors.EVENT_READ)
 
             while not self.stop_event.is_set():
-                # Poll with a timeout (100ms). Allows the loop to check self.stop_event
-                socks = dict(self.poller.poll(100))
+                # Wait with a timeout (100ms). Allows the loop to check self.stop_event
+                # The ZMQ file descriptors are edge-triggered, so every socket is drained below, whichever one woke us.
+                self.selector.select(timeout=0.1)
 
                 # --- Case 1: New Metadata ---
-                if self.md_socket in socks:
-                    self.md_socket.recv_string()
-                    md = self.md_socket.recv_json()
-                    # Bounded queue to store only the latest
-                    self._drain_queue(self.md_queue)
-                    self.md_queue.put(md)
-
-                # --- Case 2: New STXM Data Point ---
-                if self.stxm_socket in socks:
-                    self.stxm_socket.recv_string()
-                    data = self.stxm_socket.recv_json()
-                    # Unbounded queue to ensure all points are processed
-                    self.stxm_queue.put(data)
+                while self._has_message(self.md_socket):
+                    _, md_bytes = self.md_socket.recv_multipart(zmq.NOBLOCK)
+                    md = self.json_decoder.decode(md_bytes)
+                    # STXM points already waiting on the socket were sent before this metadata,
+                    # they belong to the previous scan and go into its queue first.
+                    self._receive_stxm_points()
+                    # Points of the new scan go into a fresh STXM queue, handed to the GUI together with the metadata.
+                    # Points still waiting in the old queue belong to the previous scan and are dropped with it.
+                    self.stxm_queue = queue.SimpleQueue()
+                    # Store only the latest
+                    with self.slot_lock:
+                        self.latest_md = (md, format_metadata_log(md), self.stxm_queue)
+
+                # --- Case 2: New STXM Data Points ---
+                self._receive_stxm_points()
 
                 # --- Case 3: New Frame Data ---
-                if self.frame_socket in socks:
-                    self.frame_socket.recv_string()
-                    header = self.frame_socket.recv_json(flags=0)
-                    buffer = self.frame_socket.recv(copy=False)
+                # Only the newest waiting frame is displayed, older ones are skipped
+                frame_parts = None
+                while self._has_message(self.frame_socket):
+                    frame_parts = self.frame_socket.recv_multipart(zmq.NOBLOCK, copy=False)
 
-                    frame = np.frombuffer(
-                        buffer, dtype=header['dtype']
-                    ).reshape(header['shape'])
+                if frame_parts is not None:
+                    _, header, buffer = frame_parts
+                    header = self.json_decoder.decode(header.buffer)
 
-                    # Bounded queue to store only the latest
-                    self._drain_queue(self.frame_queue)
-                    self.frame_queue.put(frame)
+                    shape = tuple(header['shape'])
+                    if not self.frame_ring or self.frame_ring[0].shape != shape:
+                        self.frame_ring = [np.empty(shape, dtype=np.float32) for _ in range(FRAME_RING_SIZE)]
+
+                    # Never write into the frame waiting in the slot or the one on display
+                    with self.slot_lock:
+                        in_use = (self.latest_frame, self.shown_frame)
+                    frame = next(buf for buf in self.frame_ring if not any(buf is used for used in in_use))
+
+                    # Frames arrive in half precision, widen them for display
+                    np.copyto(frame, np.frombuffer(buffer, dtype=header['dtype']).reshape(shape))
+
+                    # Store only the latest
+                    with self.slot_lock:
+                        self.latest_frame = frame
 
         except Exception as e:
             print(f"[Visualizer] Error in receiver thread: {e}")
         finally:
+            self.selector.close()
             self.md_socket.close()
             self.stxm_socket.close()
             self.frame_socket.close()
             self.context.term()
             print("[Visualizer] Receiver thread stopped.")
 
-    def _drain_queue(self, q):
-        """Empties a queue."""
-        while not q.empty():
-            try:
-                q.get_nowait()
-            except queue.Empty:
-                break
+    def _receive_stxm_points(self):
+        """
+        Receives all waiting STXM messages into the current STXM queue.
+        They are merged into one batch, so the GUI gets one queue item per wake-up.
+        """
+        batches = []
+        while self._has_message(self.stxm_socket):
+            _, buffer = self.stxm_socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            batches.append(np.frombuffer(buffer, dtype=STXM_POINT_DTYPE))
+
+        if batches:
+            points = batches[0] if len(batches) == 1 else np.concatenate(batches)
+            # Unbounded queue to ensure all points are processed
+            self.stxm_queue.put(points)
+
+    @staticmethod
+    def _has_message(socket):
+        """Whether a message can be received from the socket without blocking."""
+        return socket.get(zmq.EVENTS) & zmq.POLLIN
+
+    def take_metadata(self):
+        """Returns the latest (metadata, log entry, STXM queue) and empties the slot, None if nothing new arrived."""
+        with self.slot_lock:
+            md, self.latest_md = self.latest_md, None
+        return md
+
+    def take_frame(self):
+        """Returns the latest frame and empties the slot, None if nothing new arrived."""
+        with self.slot_lock:
+            frame, self.latest_frame = self.latest_frame, None
+            if frame is not None:
+                self.shown_frame = frame
+        return frame
 
     def stop(self):
         """Signals the thread to stop."""
@@ -140,6 +281,10 @@ class VisualizerWindow(QtWidgets.QMainWindow):
 
         # Data Storage
         self.stxm_map_data = None
+        self.stxm_display_data = None  # Same as stxm_map_data, but unscanned pixels are NaN (not drawn)
+        self.stxm_levels = None  # (min, max) of the scanned pixels
+        self.stxm_levels_frozen = False  # Levels fixed after the first part of the scan
+        self.stxm_map_dirty = False  # New pixels placed since the map was last drawn
         self.scan_shape = None
         self.current_metadata = None
         self.total_frames = 0
@@ -151,21 +296,30 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         self.invert_x = False
         self.invert_y = False
 
+        # Frame index -> flat position in stxm_map_data, built once per scan
+        self.pixel_lut = None
+
+        # Physical position of grid index 0 and the step per grid index, for the pixel info
+        self.x_phys_min = 0.0
+        self.x_phys_step = 0.0
+        self.y_phys_min = 0.0
+        self.y_phys_step = 0.0
+
         # Activity Tracking for Watchdog
-        self.last_activity_time = time.time()
+        self.last_activity_time = time.monotonic()
         self.is_in_standby = False
 
         # --- Queues ---
-        # Three queues to pass data from the worker thread to this main GUI thread.
-        # Bridge that decouples the threads.
-        self.md_queue = queue.Queue(maxsize=1)
-        self.stxm_queue = queue.Queue()
-        self.frame_queue = queue.Queue(maxsize=1)
+        # Queue to pass the STXM points from the worker thread to this main GUI thread.
+        # Bridge that decouples the threads. Metadata and frames are taken from the receiver's latest-only slots.
+        self.stxm_queue = queue.SimpleQueue()
 
         # --- Thread Management ---
+        # Worker threads writing the saved scans, so PNG compression does not stall the GUI
+        self.save_pool = QtCore.QThreadPool.globalInstance()
         self.stop_event = threading.Event()
         self.receiver_thread = DataReceiver(
-            self.md_queue, self.stxm_queue, self.frame_queue, self.stop_event
+            self.stxm_queue, self.stop_event
         )
 
         # --- Setup the GUI ---
@@ -178,10 +332,10 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         self.timer.timeout.connect(self.update_plots)
         self.timer.start(33) # Approx. 30 fps
 
-        # Watchdog Timer (Checks every 3 second)
+        # Watchdog Timer (Checks every 3 second, every 15 seconds while in standby)
         self.watchdog_timer = QtCore.QTimer()
         self.watchdog_timer.timeout.connect(self.check_activity)
-        self.watchdog_timer.start(3000)
+        self.watchdog_timer.start(WATCHDOG_INTERVAL_MS)
 
     def _setup_ui(self):
         """Creates the widgets and layout."""
@@ -209,6 +363,13 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         self.v_line.hide()  # HIDE by default
         self.h_line.hide()  # HIDE by default
 
+        # Cache the rendered map and crosshairs, so moving the crosshairs does not re-rasterize the map.
+        # The image cache is invalidated by pyqtgraph whenever a new image is set.
+        device_cache = QtWidgets.QGraphicsItem.CacheMode.DeviceCoordinateCache
+        self.stxm_view.getImageItem().setCacheMode(device_cache)
+        self.v_line.setCacheMode(device_cache)
+        self.h_line.setCacheMode(device_cache)
+
         # --- STXM Controls Layout ---
         # Using a grid layout
         stxm_controls_layout = QtWidgets.QGridLayout()
@@ -258,7 +419,10 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         self.save_button.clicked.connect(lambda: self.save_scan(triggered_by_button=True))
         self.auto_save_checkbox.toggled.connect(self.toggle_auto_save)
         self.pixel_info_checkbox.toggled.connect(self.toggle_pixel_info)
-        self.stxm_view.scene.sigMouseMoved.connect(self.mouse_moved_stxm)
+        # Mouse moves arrive at the mouse event rate, the pixel info only needs to follow at display rate
+        self.mouse_proxy = pg.SignalProxy(
+            self.stxm_view.scene.sigMouseMoved, rateLimit=60, slot=lambda evt: self.mouse_moved_stxm(evt[0])
+        )
         self.cmap_combo.currentTextChanged.connect(self.update_colormap)
 
         # Customize STXM view properties
@@ -296,6 +460,8 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         #  self.frame_view.ui.histogram.hide() # Uncomment to remove histogram
         self.frame_view.ui.roiBtn.hide()
         self.frame_view.ui.menuBtn.hide()
+        # Draw large frames downsampled to the screen resolution
+        self.frame_view.getImageItem().setAutoDownsample(True)
 
         # --- Final Layout ---
         layout.addLayout(frame_panel, stretch=1)
@@ -304,7 +470,7 @@ class VisualizerWindow(QtWidgets.QMainWindow):
     def check_activity(self):
         """Checks if we have received data recently."""
         # 15 second timeout
-        if (time.time() - self.last_activity_time > 15.0) and not self.is_in_standby:
+        if (time.monotonic() - self.last_activity_time > 15.0) and not self.is_in_standby:
             self.enter_standby()
 
     def enter_standby(self):
@@ -314,6 +480,8 @@ class VisualizerWindow(QtWidgets.QMainWindow):
 
         print("[Visualizer] No data received for 15s. Entering Standby.")
         self.is_in_standby = True
+        # Nothing to watch until the next scan starts, check less often
+        self.watchdog_timer.setInterval(STANDBY_WATCHDOG_INTERVAL_MS)
         self.setWindowTitle("Live STXM Viewer - STANDBY")
         self.progress_bar.hide()
         self.save_button.setEnabled(False)
@@ -322,10 +490,27 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         standby_msg = "--- STANDBY MODE (Waiting for scan) ---\n"
 
         # Insert the message at the very beginning of the QTextEdit
-        self.metadata_display.setText(standby_msg + self.metadata_display.toPlainText())
-        # Ensure the top is visible
+        self.prepend_log(standby_msg)
+        # Ensure the top is visible, the message was inserted there
+        self.metadata_display.moveCursor(QtGui.QTextCursor.MoveOperation.Start)
         self.metadata_display.ensureCursorVisible()
 
+    def prepend_log(self, text):
+        """
+        Inserts text at the top of the metadata log.
+        Only the new text is inserted, instead of reading back and re-setting the whole log.
+        """
+        cursor = QtGui.QTextCursor(self.metadata_display.document())
+        cursor.movePosition(QtGui.QTextCursor.MoveOperation.Start)
+        cursor.insertText(text)
+
+        # Drop the oldest lines at the bottom
+        document = self.metadata_display.document()
+        if document.blockCount() > MAX_LOG_LINES:
+            cursor.setPosition(document.findBlockByNumber(MAX_LOG_LINES).position() - 1)
+            cursor.movePosition(QtGui.QTextCursor.MoveOperation.End, QtGui.QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+
     def update_plots(self):
         """
         Heartbeat function called by the QTimer.
@@ -333,57 +518,64 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         """
 
         # 1. Check for New Metadata
-        try:
-            md = self.md_queue.get_nowait()
-            self.handle_metadata(md)
+        new_md = self.receiver_thread.take_metadata()
+        if new_md is not None:
+            self.handle_metadata(*new_md)
             # Reset activity timer
-            self.last_activity_time = time.time()
-            self.is_in_standby = False
+            self.last_activity_time = time.monotonic()
+            if self.is_in_standby:
+                self.is_in_standby = False
+                self.watchdog_timer.setInterval(WATCHDOG_INTERVAL_MS)
             self.setWindowTitle("Live STXM Viewer")
-        except queue.Empty:
-            pass
 
         # 2. Process ALL Queued STXM Data Points
         # Loop until the STXM queue is empty, updating the data array in memory.
-        stxm_map_was_updated = False
         while not self.stxm_queue.empty():
             try:
                 data = self.stxm_queue.get_nowait()
                 self.handle_stxm_data(data)
-                stxm_map_was_updated = True
                 # Reset activity timer
-                self.last_activity_time = time.time()
+                self.last_activity_time = time.monotonic()
             except queue.Empty:
                 break
 
-        # Check both, data arrived AND self.stxm_map_data has been initialized by the metadata.
-        if stxm_map_was_updated and self.stxm_map_data is not None:
-            # Creating a masked array.
-            # Tell numpy to "ignore" all pixels that are still equal to 0 (unscanned value).
-            masked_data = np.ma.masked_equal(self.stxm_map_data, 0)
-            self.stxm_view.setImage(masked_data.T, autoRange=False, autoLevels=True)
+        # Redraw only if new pixels were placed since the last redraw
+        self.redraw_stxm_map()
 
         # 3. Process Frame
-        try:
-            frame = self.frame_queue.get_nowait()
+        frame = self.receiver_thread.take_frame()
+        if frame is not None:
             self.handle_frame(frame)
-            self.last_activity_time = time.time()
-        except queue.Empty:
-            pass
+            self.last_activity_time = time.monotonic()
+
+    def redraw_stxm_map(self):
+        """Draws the STXM map if new pixels were placed since it was last drawn."""
+        if not self.stxm_map_dirty:
+            return
+        # Unscanned pixels are NaN in the display copy and are not drawn.
+        # Levels are tracked while placing pixels, so no histogram/min-max pass over the map is needed.
+        if self.stxm_levels_frozen and self.stxm_view.image is self.stxm_display_data:
+            # The view already shows the display array, only the image item has to re-render with the final levels.
+            # Skips ImageView's min/max pass over the whole map.
+            self.stxm_view.getImageItem().setImage(self.stxm_display_data, autoLevels=False, levels=self.stxm_levels)
+        else:
+            self.stxm_view.setImage(
+                self.stxm_display_data, autoRange=False, autoLevels=False, levels=self.stxm_levels
+            )
+        self.stxm_map_dirty = False
 
-    def handle_metadata(self, md):
-        """Called when new scan metadata is received."""
+    def handle_metadata(self, md, log_entry, stxm_queue):
+        """
+        Called when new scan metadata is received.
+        'log_entry' is the metadata formatted for the log,
+        'stxm_queue' is the queue the receiver thread fills with the points of this new scan.
+        """
         print(f"[Visualizer] Received new metadata: {md}")
 
         # If there is old data sitting in the stxm_queue from a previous aborted run,
-        # it must be thrown away before starting new scan.
-        dropped_packets = 0
-        while not self.stxm_queue.empty():
-            try:
-                self.stxm_queue.get_nowait()
-                dropped_packets += 1
-            except queue.Empty:
-                break
+        # it must be thrown away before starting new scan. Switching to the new scan's queue drops it at once.
+        dropped_packets = self.stxm_queue.qsize()
+        self.stxm_queue = stxm_queue
         if dropped_packets > 0:
             print(f"[Visualizer] Flushed {dropped_packets} stale packets from queue.")
 
@@ -392,46 +584,49 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         self.invert_y = md['y_start'] > md['y_stop']
         # direction_msg = f"Scan Direction: X={'Rev' if self.invert_x else 'Fwd'}, Y={'Fwd' if self.invert_y else 'Rev'}"
 
-        # Log to UI
-        try:
-            now = datetime.datetime.now()
-            time_string = now.strftime("%H:%M:%S")
-            header = f"--- Scan at {time_string} ---"
-            md_string = (
-                f"Scan Dimensions:\n"
-                f"  X: {md['x_num']} steps (from {md['x_start']:.3f} to {md['x_stop']:.3f})\n"
-                f"  Y: {md['y_num']} steps (from {md['y_start']:.3f} to {md['y_stop']:.3f})\n"
-                f"\n"
-                f"Detector:\n"
-                f"  Shape: {md['detector_shape'][0]} x {md['detector_shape'][1]}\n"
-                f"  Exposure: {md['exposure_time_s']:.4f} s\n"
-               # f"{direction_msg}\n"
-            )
-            new_entry = header + "\n" + md_string
-
-            if not self.first_scan_logged:
-                self.metadata_display.setText(new_entry)
-                self.first_scan_logged = True
-            else:
-                # Prepend new entry to the top
-                current_text = self.metadata_display.toPlainText()
-                self.metadata_display.setText(new_entry + "\n" + current_text)
-
-                # Scroll to top to ensure visibility
-                self.metadata_display.moveCursor(QtGui.QTextCursor.MoveOperation.Start)
+        # Log to UI, the entry was formatted by the receiver thread
+        if not self.first_scan_logged:
+            self.metadata_display.setText(log_entry)
+            self.first_scan_logged = True
+        else:
+            # Prepend new entry to the top
+            self.prepend_log(log_entry + "\n")
 
-        except KeyError as e:
-            self.metadata_display.append(f"Error: Missing key in metadata '{e}'")
-        except Exception as e:
-            self.metadata_display.append(f"Error parsing metadata:\n{e}")
+            # Scroll to top to ensure visibility
+            self.metadata_display.moveCursor(QtGui.QTextCursor.MoveOperation.Start)
 
         # Use metadata to create the 2D numpy array that will store STXM map.
         self.current_metadata = md
         self.scan_shape = (md['x_num'], md['y_num'])
         self.total_frames = md['x_num'] * md['y_num']
 
+        # Physical coordinates for the pixel info, computed once instead of on every mouse move.
+        # Use min/max because our display is always strictly Low -> High
+        # Avoid division by zero if scan is a single point (unlikely but safe)
+        x_denom = (md['x_num'] - 1) if md['x_num'] > 1 else 1
+        y_denom = (md['y_num'] - 1) if md['y_num'] > 1 else 1
+        self.x_phys_min = min(md['x_start'], md['x_stop'])
+        self.x_phys_step = (max(md['x_start'], md['x_stop']) - self.x_phys_min) / x_denom
+        self.y_phys_min = min(md['y_start'], md['y_stop'])
+        self.y_phys_step = (max(md['y_start'], md['y_stop']) - self.y_phys_min) / y_denom
+
         # Create a new data array
-        self.stxm_map_data = np.zeros(self.scan_shape, dtype=np.float32)
+        # Stored row-major as (y, x), matching pyqtgraph's 'imageAxisOrder', so it is displayed without a transpose
+        map_shape = (md['y_num'], md['x_num'])
+        self.stxm_map_data = np.zeros(map_shape, dtype=np.float32)
+        self.stxm_display_data = np.full(map_shape, np.nan, dtype=np.float32)
+        self.stxm_levels = None
+        self.stxm_levels_frozen = False
+
+        # Precompute where each frame index lands in the map, the scan geometry is fixed for the whole scan.
+        # Calculate Sequence Coords from the 1D frame indices
+        index = np.arange(self.total_frames, dtype=np.intp)
+        seq_x = index % self.scan_shape[0]
+        seq_y = index // self.scan_shape[0]
+        # Apply Spatial Inversion
+        spatial_x = (self.scan_shape[0] - 1) - seq_x if self.invert_x else seq_x
+        spatial_y = (self.scan_shape[1] - 1) - seq_y if self.invert_y else seq_y
+        self.pixel_lut = np.ravel_multi_index((spatial_y, spatial_x), map_shape)
 
         # Reset and show progress bar
         self.progress_bar.setMaximum(self.total_frames)
@@ -442,63 +637,74 @@ class VisualizerWindow(QtWidgets.QMainWindow):
         self.save_button.setEnabled(False)
         self.save_button.setText("Save Current Scan Data")
 
-        self.stxm_view.setImage(self.stxm_map_data.T, autoRange=True, autoLevels=True)
+        self.stxm_view.setImage(self.stxm_map_data, autoRange=True, autoLevels=True)
+        self.stxm_map_dirty = False
 
-    def handle_stxm_data(self, data):
+    def handle_stxm_data(self, points):
         """
-        Called to update a single pixel in the STXM map.
+        Called to update the STXM map with a batch of (index, intensity) points.
         This function just updates the data array in memory.
         """
         if self.stxm_map_data is None:
             return
 
-        # Calculate the (x, y) coordinate from the 1D frame_index.
-        index = data['index']
-        intensity = data['intensity']
+        index = points['index'].astype(np.intp)
+        intensity = points['intensity']
 
         # Guard against indices larger than current map
         # (Should happen rarely as queue is flushed, for good safety)
-        if index >= self.total_frames:
+        valid = index < self.total_frames
+        if not valid.all():
+            index = index[valid]
+            intensity = intensity[valid]
+        if index.size == 0:
             return
 
-        # Calculate Sequence Coords
-        seq_x = index % self.scan_shape[0]
-        seq_y = index // self.scan_shape[0]
-
-        # Apply Spatial Inversion
-        if self.invert_x:
-            spatial_x = (self.scan_shape[0] - 1) - seq_x
-        else:
-            spatial_x = seq_x
+        # Update Map, the lookup table already includes the spatial inversion
+        flat_index = self.pixel_lut[index]
+        np.put(self.stxm_map_data, flat_index, intensity)
+        np.put(self.stxm_display_data, flat_index, intensity)
+        self.stxm_map_dirty = True
 
-        if self.invert_y:
-            spatial_y = (self.scan_shape[1] - 1) - seq_y
-        else:
-            spatial_y = seq_y
+        current_progress = int(index.max()) + 1
 
-        # 3. Update Map
-        if spatial_y < self.scan_shape[1]:
-            self.stxm_map_data[spatial_x, spatial_y] = intensity
+        # Extend the display levels with this batch, until enough of the scan is placed to be representative
+        if not self.stxm_levels_frozen:
+            batch_min = float(intensity.min())
+            batch_max = float(intensity.max())
+            if self.stxm_levels is None:
+                self.stxm_levels = (batch_min, batch_max)
+            else:
+                self.stxm_levels = (min(self.stxm_levels[0], batch_min), max(self.stxm_levels[1], batch_max))
+            self.stxm_levels_frozen = current_progress >= LEVELS_FREEZE_FRACTION * self.total_frames
 
-            current_progress = index + 1
-            self.progress_bar.setValue(current_progress)
+        self.progress_bar.setValue(current_progress)
 
-            # Check if scan is complete
-            if current_progress == self.total_frames:
-                self.progress_bar.setFormat("Scan Complete! [%v/%m] (100%)")
-                self.save_button.setEnabled(True)
+        # Check if scan is complete
+        if current_progress == self.total_frames:
+            self.progress_bar.setFormat("Scan Complete! [%v/%m] (100%)")
+            self.save_button.setEnabled(True)
 
-                if self.auto_save_enabled:
-                    print("[Visualizer] Auto-saving scan (Scan Complete)...")
-                    self.save_scan(triggered_by_button=False)
+            if self.auto_save_enabled:
+                print("[Visualizer] Auto-saving scan (Scan Complete)...")
+                self.save_scan(triggered_by_button=False)
 
     def handle_frame(self, frame):
         """Displays the latest detector frame."""
-        self.frame_view.setImage(
-            frame,
-            autoRange=False,
-            autoLevels=False
-        )
+        image_item = self.frame_view.getImageItem()
+        if image_item.image is not None and image_item.image.shape == frame.shape:
+            # Same frame shape: the image item re-renders into its reused ARGB buffer.
+            # Skips ImageView's min/max pass over every frame.
+            image_item.setImage(frame, autoLevels=False)
+        else:
+            # ImageView keeps its own reference to this image, give it a copy instead of a receiver ring buffer
+            # that is overwritten by later frames. The image item itself only ever shows the frame the receiver
+            # keeps untouched until the next one is taken.
+            self.frame_view.setImage(
+                frame.copy(),
+                autoRange=False,
+                autoLevels=False
+            )
 
     def closeEvent(self, event):
         """
@@ -528,25 +734,32 @@ class VisualizerWindow(QtWidgets.QMainWindow):
 
         print(f"[Visualizer] Saving scan to {filepath_base}...")
 
-        try:
-            # Save the raw data as a NumPy file
-            np.save(f"{filepath_base}_data.npy", self.stxm_map_data)
-
-            # Save the metadata as a JSON file
-            with open(f"{filepath_base}_meta.json", 'w') as f:
-                json.dump(self.current_metadata, f, indent=4)
-
-            # Save a quick-look PNG of the view
-            exporter = exporters.ImageExporter(self.stxm_view.getImageItem())
-            exporter.export(f"{filepath_base}_image.png")
-
-            print(f"[Visualizer] Save complete.")
-
-            if triggered_by_button:
-                self.save_button.setText("Saved!")
-                QtCore.QTimer.singleShot(2000, lambda: self.save_button.setText("Save Current Scan Data"))
-        except Exception as e:
-            print(f"[Visualizer] ERROR saving scan: {e}")
+        # Snapshot everything on the GUI thread, the files are written by a worker thread.
+        # The map is brought up to date first, auto-save runs before the next heartbeat would redraw it.
+        self.redraw_stxm_map()
+        image_item = self.stxm_view.getImageItem()
+        image_item.render()
+        # No rendered image for an empty or all-NaN map, then only the data and metadata are saved.
+        # The rendered QImage wraps a buffer reused by the next render, so it is copied.
+        qimage = image_item.qimage.copy() if image_item.qimage is not None else None
+        # Place the rendered map the way it is shown in the view, like pyqtgraph's ImageExporter does
+        scene_rect = image_item.sceneBoundingRect()
+        transform = image_item.sceneTransform() * QtGui.QTransform.fromTranslate(-scene_rect.left(), -scene_rect.top())
+        background = self.stxm_view.getView().scene().views()[0].backgroundBrush().color()
+        self.save_pool.start(functools.partial(
+            write_scan_files,
+            filepath_base,
+            self.stxm_map_data.T.copy(),  # indexed as (x, y)
+            dict(self.current_metadata),
+            qimage,
+            transform,
+            scene_rect.size().toSize(),
+            background,
+        ))
+
+        if triggered_by_button:
+            self.save_button.setText("Saved!")
+            QtCore.QTimer.singleShot(2000, lambda: self.save_button.setText("Save Current Scan Data"))
 
     def toggle_auto_save(self, checked):
         """Called when the auto-save checkbox is toggled."""
@@ -585,24 +798,11 @@ class VisualizerWindow(QtWidgets.QMainWindow):
 
             # Check if the index is valid
             if 0 <= x_idx < self.scan_shape[0] and 0 <= y_idx < self.scan_shape[1]:
-                val = self.stxm_map_data[x_idx, y_idx]
+                val = self.stxm_map_data[y_idx, x_idx]
 
                 # Calculate Physical Coordinates
-                md = self.current_metadata
-
-                # Use min/max because our display is always strictly Low -> High
-                x_min = min(md['x_start'], md['x_stop'])
-                x_max = max(md['x_start'], md['x_stop'])
-
-                # Avoid division by zero if scan is a single point (unlikely but safe)
-                x_denom = (self.scan_shape[0] - 1) if self.scan_shape[0] > 1 else 1
-                y_denom = (self.scan_shape[1] - 1) if self.scan_shape[1] > 1 else 1
-
-                x_phys = x_min + (x_idx / x_denom) * (x_max - x_min)
-
-                y_min = min(md['y_start'], md['y_stop'])
-                y_max = max(md['y_start'], md['y_stop'])
-                y_phys = y_min + (y_idx / y_denom) * (y_max - y_min)
+                x_phys = self.x_phys_min + x_idx * self.x_phys_step
+                y_phys = self.y_phys_min + y_idx * self.y_phys_step
 
                 self.pixel_info_label.setText(
                     f"Grid: ({x_idx}, {y_idx}) | Position: ({x_phys:.3f}, {y_phys:.3f}) | Val: {val:.2f}"
@@ -627,6 +827,11 @@ def main():
     """
     # Set pyqtgraph config
     pg.setConfigOption('imageAxisOrder', 'row-major')  # 'row-major' = (y, x)
+    try:
+        import numba  # noqa: F401
+        pg.setConfigOption('useNumba', True)  # JIT-compiled level scaling / LUT in ImageItem
+    except ImportError:
+        pass
 
     app = QtWidgets.QApplication(sys.argv)
     window = VisualizerWindow()